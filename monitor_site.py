@@ -1,10 +1,109 @@
 #!/usr/bin/env python3
 
 import argparse
+import concurrent.futures
+import functools
+import os
+import pickle
 import re
+import signal
+import subprocess
 import sys
+import threading
 import time
 from datetime import datetime
+from urllib.parse import urlparse, parse_qs, urlencode
+
+_SORT_RE = re.compile(r'([A-Za-z]*)(\d+)([A-Za-z]*)')
+
+BLOCKED_URLS = ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.woff', '*.woff2', '*.ttf']
+
+DRIVER_CACHE = os.path.expanduser('~/.cache/bcparks/driver.pkl')
+
+# Resolves true once document has more than min_count elements matching selector
+# and none of them changed for quiet_ms; false if that did not happen in max_ms.
+# Deliberately doesn't wait for readyState 'complete', that would undo the eager page load
+DOM_QUIET_JS = """
+var selector = arguments[0], quietMs = arguments[1], minCount = arguments[2], maxMs = arguments[3];
+var done = arguments[arguments.length - 1];
+var timer = null;
+
+function touches(node) {
+    return node.nodeType === 1 && (node.matches(selector) || node.querySelector(selector) !== null);
+}
+
+function finish(result) {
+    observer.disconnect();
+    clearTimeout(timer);
+    clearTimeout(deadline);
+    done(result);
+}
+
+function arm() {
+    clearTimeout(timer);
+    timer = setTimeout(function () {
+        if (document.querySelectorAll(selector).length > minCount) {
+            finish(true);
+        } else {
+            arm();
+        }
+    }, quietMs);
+}
+
+var observer = new MutationObserver(function (mutations) {
+    for (var i = 0; i < mutations.length; i++) {
+        var m = mutations[i];
+        if (m.type === 'attributes' ? m.target.matches(selector)
+                                    : Array.prototype.some.call(m.addedNodes, touches) ||
+                                      Array.prototype.some.call(m.removedNodes, touches)) {
+            arm();
+            return;
+        }
+    }
+});
+
+var deadline = setTimeout(function () { finish(false); }, maxMs);
+observer.observe(document.body, {childList: true, subtree: true, attributes: true, attributeFilter: ['class']});
+arm();
+"""
+
+# True once the map container holds more than arguments[0] icons
+MAP_READY_JS = "return document.querySelectorAll('.map-container .map-icon').length > arguments[0];"
+
+# Labels of all available icons, taken from the first .map-site-label following each icon
+AVAILABLE_SITES_JS = """
+return Array.from(document.querySelectorAll('.map-icon.icon-available')).map(function (icon) {
+    var sib = icon.nextElementSibling;
+    while (sib && !sib.classList.contains('map-site-label')) {
+        sib = sib.nextElementSibling;
+    }
+    var label = sib ? sib.querySelector('.resource-label') : null;
+    return label ? label.textContent.trim().toLowerCase() : null;
+}).filter(Boolean);
+"""
+
+# Same availability the map shows, fetched from the reservation API the page itself uses.
+# Resolves with lowercase names of available sites, or null if either request failed
+AVAILABILITY_FETCH_JS = """
+var done = arguments[arguments.length - 1];
+Promise.all([arguments[0], arguments[1]].map(function (url) {
+    return fetch(url, {headers: {'Accept': 'application/json'}, credentials: 'same-origin'}).then(function (r) {
+        if (!r.ok) {
+            throw new Error(r.status);
+        }
+        return r.json();
+    });
+})).then(function (res) {
+    var names = res[0], avail = res[1].resourceAvailabilities || {};
+    done(Object.keys(avail).filter(function (id) {
+        return avail[id][0] && avail[id][0].availability === 0 && names[id];
+    }).map(function (id) {
+        return names[id].localizedValues[0].name.trim().toLowerCase();
+    }));
+}).catch(function () {
+    done(null);
+});
+"""
 
 def shorten_url(url):
     """Convert long URLs to short """
@@ -13,7 +112,7 @@ def shorten_url(url):
 
 def current_time():
     """Return current date in a desired format"""
-    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return datetime.now().isoformat(sep = ' ', timespec = 'seconds')
 
 def pp(message, error = False):
     """
@@ -22,13 +121,16 @@ def pp(message, error = False):
     :param str message : title of the message 
     """
     if error:
-        sys.exit('{} - {}'.format(current_time(), message))
+        sys.exit(f'{current_time()} - {message}')
     else:
-        print('{} - {}'.format(current_time(), message))
+        print(f'{current_time()} - {message}')
 
 def comma_separated_list(value):
-    """Converts a comma-separated string into a list"""
-    return [item.strip().lower() for item in value.split(',')]
+    """Converts a comma-separated string into a list, rejects one without any site"""
+    items = [item.strip().lower() for item in value.split(',') if item.strip()]
+    if not items:
+        raise argparse.ArgumentTypeError('no sites given in {!r}'.format(value))
+    return items
 
 def sort_key(s):
     """
@@ -38,7 +140,7 @@ def sort_key(s):
     :param s : alphanumeric value (examples: 2, S15, 18B) 
     :return  : a tuple (example: ("", 2, "") or ("S", 15, "") or ("", 18, "B")
     """
-    match = re.match(r'([A-Za-z]*)(\d+)([A-Za-z]*)', s.strip())
+    match = _SORT_RE.match(s.strip())
     if match:
         prefix, number, suffix = match.groups()
         return (prefix, int(number), suffix)
@@ -62,60 +164,110 @@ def send_sms(message, client, to_number, from_number):
 
     pp('SMS sent: {}'.format(message.sid))
 
-def get_available_sites(driver, url, max_attempts = 5, retry_delay = 1):
+def wait_dom_quiet(driver, selector = '.map-icon', quiet_ms = 400, timeout = 10, min_count = 10):
     """
-    Returns a dictionary of {label: icon_element} for all available campsites,
-    with retries and smarter load timing to avoid stale references.
+    Blocks until no elements matching selector were added, removed or re-classed
+    for quiet_ms milliseconds
+
+    :param  obj driver    : WebDriver instance
+    :param  str selector  : css selector of the elements to watch
+    :param  int quiet_ms  : how long the DOM must stay unchanged (ms)
+    :param  int timeout   : max time to wait in seconds
+    :param  int min_count : min number of matching elements required
+    :return bool          : True if the DOM settled, False if it was still changing after timeout
     """
+    # The script gives up on its own after timeout, the driver limit is only a backstop
+    driver.set_script_timeout(timeout + 5)
+    try:
+        return bool(driver.execute_async_script(DOM_QUIET_JS, selector, quiet_ms, min_count, timeout * 1000))
+    except ScriptTimeoutException:
+        return False
+
+def api_urls(url):
+    """
+    Builds reservation API urls backing the map page
+
+    :param  str   url : url of the camping site
+    :return tuple     : (site names url, site availability url) or None if url lacks required params
+    """
+    parsed = urlparse(url)
+    params = {key: value[0] for key, value in parse_qs(parsed.query).items()}
+
+    try:
+        names  = {key: params[key] for key in ('resourceLocationId', 'mapId')}
+        status = {key: params[key] for key in ('mapId', 'startDate', 'endDate')}
+    except KeyError:
+        return None
+
+    base = '{}://{}/api/'.format(parsed.scheme, parsed.netloc)
+    return ('{}resourcelocation/resources?{}'.format(base, urlencode(names)),
+            '{}availability/map?{}'.format(base, urlencode(status)))
+
+def refresh_available_sites(driver, urls, timeout = 30):
+    """
+    Re-reads availability through the page's own API instead of reloading the whole map
+
+    :param  obj   driver  : WebDriver instance, already on the map page
+    :param  tuple urls    : (site names url, site availability url) as returned by api_urls
+    :param  int   timeout : max time to wait for both requests in seconds
+    :return list          : naturally sorted list of available sites or None on failure
+    """
+    try:
+        driver.set_script_timeout(timeout)
+        sites = driver.execute_async_script(AVAILABILITY_FETCH_JS, *urls)
+    except WebDriverException as e:
+        pp('⚠️  Availability refresh failed: {}'.format(type(e).__name__))
+        return None
+
+    return None if sites is None else sorted(set(sites), key=sort_key)
+
+def log_sms_result(future, failed = None):
+    """
+    Reports an SMS that failed to send in the background
+
+    :param obj future : Future returned by submitting send_sms
+    :param obj failed : threading.Event set when sending failed, so the sites get reported again
+    """
+    if future.exception():
+        pp('❌ SMS failed: {}'.format(future.exception()))
+        if failed is not None:
+            failed.set()
+
+def get_available_sites(driver, url, max_attempts = 5, retry_delay = 1, urls = None, stop = None):
+    """
+    Returns a naturally sorted list of unique lowercase labels of all available campsites,
+    with retries and smarter load timing, or None if they could not be retrieved.
+    When the map page is already open and urls (see api_urls) are given, availability
+    is re-read from the page's API and the page is only reloaded if that fails.
+    Once stop (threading.Event) is set, no further attempts are made.
+    """
+    stop = stop if stop is not None else threading.Event()
+
+    if urls and urlparse(driver.current_url).netloc == urlparse(url).netloc:
+        available = refresh_available_sites(driver, urls)
+        if available is not None:
+            return available
 
     for attempt in range(max_attempts):
-        available = []
+        if stop.is_set():
+            return None
 
         try:
             pp('⏳ Scanning for available sites (attempt {}/{})...'.format(attempt + 1, max_attempts))
             driver.get(url)
 
+            # Map container and its icons checked together, one round-trip per poll
             WebDriverWait(driver, 30).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, '.map-container'))
+                lambda d: d.execute_script(MAP_READY_JS, 10)
             )
 
-            WebDriverWait(driver, 15).until(
-                lambda d: len(d.find_elements(By.CLASS_NAME, 'map-icon')) > 10
-            )
+            # Wait for the icons to stop being added/removed before reading them,
+            # best-effort: a map that keeps changing is still scanned as is
+            if not wait_dom_quiet(driver):
+                pp('⚠️  Map icons still changing, scanning anyway')
 
-            # Optional: wait for icon count to stabilize
-            stable_count = 0
-            last_count = 0
-            for _ in range(5):
-                icons = driver.find_elements(By.CLASS_NAME, 'map-icon')
-                count = len(icons)
-                if count == last_count:
-                    stable_count += 1
-                    if stable_count >= 2:
-                        break
-                else:
-                    stable_count = 0
-                    last_count = count
-                time.sleep(0.5)
-
-            icons = driver.find_elements(By.CLASS_NAME, 'map-icon')
-
-            for i, icon in enumerate(icons):
-                try:
-                    if 'icon-available' not in icon.get_attribute('class'):
-                        continue
-
-                    label_el = icon.find_element(By.XPATH, './following-sibling::*[contains(@class, "map-site-label")]')
-                    label_text = label_el.find_element(By.CLASS_NAME, 'resource-label').text.strip().lower()
-
-                    if label_text:
-                        available.append(label_text)
-
-                except (StaleElementReferenceException, NoSuchElementException) as e:
-                    pp('⚠️  Skipped icon[{}] due to: {}'.format(i, type(e).__name__))
-                    continue
-
-            return available
+            # Single in-page pass, no per-icon round-trips to chromedriver
+            return sorted(set(driver.execute_script(AVAILABLE_SITES_JS)), key=sort_key)
 
         except TimeoutException:
             pp('❌ Timeout waiting for icons or map')
@@ -125,46 +277,126 @@ def get_available_sites(driver, url, max_attempts = 5, retry_delay = 1):
         except Exception as e:
             pp('❌ Unexpected error: {}'.format(e))
 
-        time.sleep(retry_delay)
+        stop.wait(retry_delay)
 
     pp('❌ Failed to retrieve available sites after {} attempts'.format(max_attempts))
-    return {}
+    return None
 
-def setup_webdriver():
+def chrome_version():
+    """
+    Returns installed Google Chrome version string
+
+    :return: version (example: 'Google Chrome 124.0.6367.60') or None if unknown
+    """
+    try:
+        result = subprocess.run(['google-chrome', '--version'], capture_output = True, text = True, timeout = 10)
+        return result.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def _get_driver_path():
+    """
+    Returns path to a ChromeDriver matching installed Chrome.
+    Reuses the path cached by a previous run as long as Chrome version has not changed,
+    otherwise resolves it with ChromeDriverManager (network) and caches the result
+
+    :return: path to chromedriver binary
+    """
+    version = chrome_version()
+
+    try:
+        with open(DRIVER_CACHE, 'rb') as f:
+            cached = pickle.load(f)
+        driver_path = cached.get('driver_path')
+        if version and cached.get('chrome_version') == version and isinstance(driver_path, str) and os.path.exists(driver_path):
+            return driver_path
+    except Exception:
+        # Missing or unreadable cache (unpickling can raise nearly anything), resolve again
+        pass
+
+    driver_path = ChromeDriverManager().install()
+
+    if version:
+        try:
+            os.makedirs(os.path.dirname(DRIVER_CACHE), exist_ok = True)
+            with open(DRIVER_CACHE, 'wb') as f:
+                pickle.dump({'chrome_version': version, 'driver_path': driver_path}, f)
+        except OSError as e:
+            pp('⚠️  Could not cache driver path: {}'.format(e))
+
+    return driver_path
+
+def add_browser_options(options):
+    """
+    Adds headless Chrome flags and prefs used when the script launches the browser itself
+
+    :param obj options : Chrome Options instance
+    """
+    options.add_argument('--headless=new')
+    options.add_argument('--no-sandbox')   # Helps in some environments
+    options.add_argument('--disable-dev-shm-usage')  # Helps with shared memory issues
+    options.add_argument('--log-level=3')  # Suppress unnecessary logs
+    options.add_argument('--disable-extensions')
+    options.add_argument('--disable-background-timer-throttling')
+    options.add_argument('--disable-renderer-backgrounding')
+    options.add_argument('--mute-audio')
+    options.add_argument('--hide-scrollbars')
+    options.add_argument('--blink-settings=imagesEnabled=false')  # Site labels are text, skip decoding map images
+    # Background services irrelevant to scraping a map
+    options.add_argument('--disable-features=Translate,MediaRouter,OptimizationHints,InterestFeedContentSuggestions')
+    options.add_argument('--disable-background-networking')
+    options.add_argument('--disable-sync')
+    options.add_argument('--disable-default-apps')
+    options.add_argument('--no-first-run')
+    options.add_argument('--no-default-browser-check')
+    options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2,
+                                              'profile.default_content_setting_values.notifications': 2})
+
+def setup_webdriver(attach_port = None):
     """
     Sets up and returns a Chrome WebDriver instance with optimized options.
     
+    :param int attach_port : remote debugging port of an already running Chrome to attach to
     :return: WebDriver instance or None on failure
     """
     options = Options()
-    options.add_argument('--headless')
-    options.add_argument('--disable-gpu')  # Helps stability in headless mode
-    options.add_argument('--no-sandbox')   # Helps in some environments
-    options.add_argument('--disable-dev-shm-usage')  # Helps with shared memory issues
-    options.add_argument('--log-level=3')  # Suppress unnecessary logs
+    # Session capability, applies to attached browsers too. driver.get returns at
+    # DOMContentLoaded, the map itself is awaited explicitly
+    options.page_load_strategy = 'eager'
+    if attach_port:
+        # Browser flags are set by whoever started Chrome, only point the driver at it
+        options.add_experimental_option('debuggerAddress', '127.0.0.1:{}'.format(attach_port))
+    else:
+        add_browser_options(options)
 
     try:
-        driver = webdriver.Chrome(service=ChromeService(ChromeDriverManager().install()), options=options)
+        driver = webdriver.Chrome(service=ChromeService(_get_driver_path()), options=options)
         driver.set_page_load_timeout(60)  # Prevent long waits on slow connections
-        return driver
     except WebDriverException as e:
         pp('❌ WebDriver failed to start: {}'.format(e))
         return None
 
+    # Don't download map tiles and fonts. CSS stays, map icons are styled by it.
+    # Only saves bandwidth, the driver is usable without it
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URLS})
+    except WebDriverException as e:
+        pp('⚠️  Could not block image/font downloads: {}'.format(e))
+
+    return driver
+
 if __name__ == '__main__':
     try:
         from selenium import webdriver
         from selenium.common.exceptions import (
-            StaleElementReferenceException,
+            ScriptTimeoutException,
             TimeoutException,
-            WebDriverException,
-            NoSuchElementException
+            WebDriverException
         )
         from selenium.webdriver.chrome.service import Service as ChromeService
         from selenium.webdriver.chrome.options import Options
-        from selenium.webdriver.common.by import By
         from selenium.webdriver.support.ui import WebDriverWait
-        from selenium.webdriver.support import expected_conditions as EC
         from webdriver_manager.chrome import ChromeDriverManager
     except ImportError:
         sys.exit('Error: selenium or webdriver_manager module not found. Install with `pip install selenium webdriver-manager`')
@@ -228,6 +460,12 @@ if __name__ == '__main__':
                          default  = '',
                          required = False
     )
+    parser.add_argument('--attach_port', '--ap',
+                         help     = 'Attach to a running Chrome on this remote debugging port',
+                         type     = int,
+                         default  = None,
+                         required = False
+    )
 
     args = parser.parse_args()
 
@@ -243,31 +481,83 @@ if __name__ == '__main__':
         except ImportError:
             sys.exit('Error: pyshorteners module not found. Please install it using `pip install pyshorteners`')
 
-    driver = setup_webdriver()
+        # URL is constant for the session, shorten it once rather than per SMS
+        try:
+            short_url = shorten_url(args.url)
+        except Exception as e:
+            pp('⚠️  Could not shorten URL, sending it in full: {}'.format(e))
+            short_url = args.url
+
+        # Twilio latency must not delay the next check
+        sms_pool = concurrent.futures.ThreadPoolExecutor(max_workers = 2)
+
+    filter_set = set(args.filter) if args.filter else None
+
+    urls = api_urls(args.url)
+    if not urls:
+        pp('⚠️  URL lacks resourceLocationId/mapId/startDate/endDate, reloading the full page on every check')
+
+    driver = setup_webdriver(args.attach_port)
     if not driver:
         sys.exit('❌ WebDriver initialization failed. Exiting...')
 
+    # First Ctrl+C wakes the loop up instead of raising mid-scan, a second one aborts right away
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        stop.set()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    signal.signal(signal.SIGINT, request_stop)
+
+    # Sites included in the last SMS, only a different set triggers a new one.
+    # A failed send sets sms_failed, which forgets that set so the next poll retries
+    last_reported = frozenset()
+    sms_failed = threading.Event()
+
     try:
-        while True:
-            available_sites = get_available_sites(driver, args.url)
+        while not stop.is_set():
+            # Fixed cadence regardless of how long the scan takes
+            deadline = time.monotonic() + args.interval
+
+            available_sites = get_available_sites(driver, args.url, urls = urls, stop = stop)
 
-            if args.filter:
-                available_sites = [site for site in args.filter if site in available_sites]
+            # Failed scan says nothing about availability, keep the last report and try again
+            if available_sites is None:
+                stop.wait(max(0, deadline - time.monotonic()))
+                continue
+
+            if filter_set:
+                available_sites = [site for site in available_sites if site in filter_set]
 
             if available_sites:
-                pp('✨ Found {} available sites: {}'.format(len(available_sites),','.join(sorted(available_sites, key=sort_key))))
+                # Timestamp and site list built once, shared by the console line and the SMS
+                timestamp = current_time()
+                joined = ','.join(available_sites)
+                print(f'{timestamp} - ✨ Found {len(available_sites)} available sites: {joined}')
                 if args.sms:
-                    send_sms('{} - Available sites: {}\n{}'.format(current_time(),','.join(available_sites), shorten_url(args.url)),
-                              client,args.my_phone_number, args.twilio_number
-                    )
+                    if sms_failed.is_set():
+                        sms_failed.clear()
+                        last_reported = frozenset()
+
+                    if frozenset(available_sites) != last_reported:
+                        sms_pool.submit(send_sms, f'{timestamp} - Available sites: {joined}\n{short_url}',
+                                        client,args.my_phone_number, args.twilio_number
+                        ).add_done_callback(functools.partial(log_sms_result, failed = sms_failed))
+                        last_reported = frozenset(available_sites)
             else:
                 pp('❌ No Availability')
+                last_reported = frozenset()
 
-            time.sleep(args.interval)
+            stop.wait(max(0, deadline - time.monotonic()))
 
-    except KeyboardInterrupt:
         pp('🛑 Script interrupted by user')
+
+    except KeyboardInterrupt:
+        pp('🛑 Script aborted by user')
     except Exception as e:
         pp('❌ Unexpected error: {}'.format(e))
     finally:
+        if args.sms:
+            sms_pool.shutdown(wait = True)
         driver.quit()
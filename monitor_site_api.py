@@ -1,21 +1,47 @@
 #!/usr/bin/env python3
 import argparse
+import concurrent.futures
+import functools
+import random
 import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import signal
+import threading
 import time
 import sys
 from datetime import datetime
 from urllib.parse import urlparse, parse_qs, urlencode
 
+# orjson (optional) parses the API responses several times faster than stdlib json
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# Longest wait between retries after failed checks, in seconds
+MAX_BACKOFF = 600
+
+class BcParksError(Exception):
+    """Raised when the reservation API can't be queried or its response can't be read"""
+
+_SORT_RE = re.compile(r'([A-Za-z]*)(\d+)([A-Za-z]*)')
+
 def shorten_url(url):
     """Convert long URLs to short """
     s = pyshorteners.Shortener()
     return s.tinyurl.short(url)
 
 def comma_separated_list(value):
-    """Converts a comma-separated string into a sorted list of numbers"""
-    return sorted([item.strip() for item in value.split(',')], key = sort_key)
-
+    """Converts a comma-separated string into a sorted list of numbers, rejects one without any site"""
+    items = [item.strip() for item in value.split(',') if item.strip()]
+    if not items:
+        raise argparse.ArgumentTypeError('no sites given in {!r}'.format(value))
+    items.sort(key = sort_key)
+    return items
+
+@functools.lru_cache(maxsize = 1024)
 def sort_key(s):
     """
     Natural sorting function, sorts a list of alphanumeric values (excluding special characters)
@@ -23,7 +49,7 @@ def sort_key(s):
     :param s : alphanumeric value (examples: 2, S15, 18B) 
     :return  : a tuple (example: ("", 2, "") or ("S", 15, "") or ("", 18, "B")
     """
-    match = re.match(r'([A-Za-z]*)(\d+)([A-Za-z]*)', s.strip())
+    match = _SORT_RE.match(s.strip())
     if match:
         prefix, number, suffix = match.groups()
         return (prefix, int(number), suffix)
@@ -47,40 +73,68 @@ def send_sms(message, client, to_number, from_number):
 
     print(f"SMS sent: {message.sid}")
 
-def get_available_sites(sites, desired_sites):
+def log_sms_result(future, failed = None):
     """
-    Filters available campsite listings and returns only whatever is desired, avalable
+    Reports an SMS that failed to send in the background
 
-    :param  dict sites         : all campsites in a given park 
-    :param  list desired_sites : user specified campsites
-    :return list               : sorted list of available site names
+    :param obj future : Future returned by submitting send_sms
+    :param obj failed : threading.Event set when sending failed, so the sites get reported again
+    """
+    if future.exception():
+        print('❌ SMS failed: {}'.format(future.exception()))
+        if failed is not None:
+            failed.set()
+
+def site_names(n_dict):
+    """
+    Extracts campsite names from the park's resource catalog
+
+    :param  dict n_dict : dictionary of the all campsites and their names for given url
+    :return dict        : campsite id to name
     """
     try:
-        available_sites = [ site for site in sites if sites[site].get('status') == 0 and site in desired_sites ]
+        names = {key: value.get('localizedValues', {})[0].get('name', '') for key, value in n_dict.items()}
     except Exception as e:
-        sys.exit('Error while determining available sites: {}'.format(e))
+        raise BcParksError('Error extracting site names: {}'.format(e))
 
-    return available_sites
+    return names
 
-def normalize_sites(n_dict, a_dict):
+def unknown_site_ids(names, a_dict):
     """
-    Matches and extract needed bits from two dicts to combine into one usable one
+    Finds campsites in the availability response that are missing from the site catalog
 
-    :param   dict n_dict : dictionary of the all campsites and their names for given url 
-    :param   dict a_dict : dictionary of campsites' availility for given url 
+    :param  dict names  : campsite id to name, as returned by site_names
+    :param  dict a_dict : dictionary of campsites' availility for given url
+    :return set         : ids not present in names
+    """
+    try:
+        return set(a_dict.get('resourceAvailabilities', {})) - names.keys()
+    except Exception as e:
+        raise BcParksError('Error reading site availability: {}'.format(e))
 
-    :return: dict        : sorted dict of campsites' name, availability and id
+def get_available_sites(names, a_dict, desired_sites = None):
     """
-    merged = {}
+    Picks available campsites straight from the availability response, in one pass,
+    and returns only whatever is desired, avalable. Sites missing from names are skipped
+
+    :param  dict      names         : campsite id to name, as returned by site_names
+    :param  dict      a_dict        : dictionary of campsites' availility for given url
+    :param  frozenset desired_sites : user specified campsites, None for all
+    :return list                    : sorted list of available site names
+    """
+    available_sites = []
     try:
-        for key in a_dict.get('resourceAvailabilities', {}):
-            name  = n_dict[key].get('localizedValues', {})[0].get('name', '')
-            status = a_dict.get('resourceAvailabilities', {}).get(key, {})[0].get('availability', '')
-            merged[name] = {'status': status, 'id': key}
+        for key, value in a_dict.get('resourceAvailabilities', {}).items():
+            if value[0].get('availability') != 0:
+                continue
+            name = names.get(key)
+            if name is not None and (desired_sites is None or name in desired_sites):
+                available_sites.append(name)
     except Exception as e:
-        sys.exit('Error nomalizing two dicts: {}'.format(e))
+        raise BcParksError('Error while determining available sites: {}'.format(e))
 
-    return {k: merged[k] for k in sorted(merged, key=sort_key)}
+    available_sites.sort(key = sort_key)
+    return available_sites
 
 def parse_url(url, params):
     """
@@ -98,28 +152,49 @@ def parse_url(url, params):
             missing_params =  set(params) - set(url_params.keys())
             raise ValueError('Missing params: {}'.format(missing_params))
     except Exception as e:
-        sys.exit('Invalid URL: {}'.format(e))
+        raise BcParksError('Invalid URL: {}'.format(e))
     
     return url_params 
 
-def make_request(url, headers):
+def make_session(headers):
+    """
+    Creates a keep-alive HTTP session that retries transient failures with backoff
+
+    :param  dict headers : headers sent with every request
+    :return obj          : requests.Session instance
+    """
+    session = requests.Session()
+    session.headers.update(headers)
+
+    retry = Retry(total = 3, backoff_factor = 0.5, status_forcelist = [429, 500, 502, 503, 504])
+    session.mount('https://', HTTPAdapter(pool_connections = 2, pool_maxsize = 4, max_retries = retry))
+
+    return session
+
+def make_request(session, url):
+    """
+    Fetches url and decodes its JSON body
+
+    :param  obj session : requests.Session instance
+    :param  str url     : url to fetch
+    :return dict        : decoded response
+    """
     try:
-        response = requests.get(url, headers = headers)
-        response = response.json()
+        response = session.get(url, timeout = 10)
+        response.raise_for_status()
+        # Parsed straight from bytes, no intermediate str decode
+        response = json_loads(response.content)
     except Exception as e:
-        sys.exit('Error fetching {}: {}'.format(url, e))
+        raise BcParksError('Error fetching {}: {}'.format(url, e))
+
+    if not isinstance(response, dict):
+        raise BcParksError('Unexpected response from {}: {!r}'.format(url, response))
 
     return response
 
 
 if __name__ == '__main__':
 
-    # PyShorter - TinyURL
-    import pyshorteners
-
-    # Twilio API
-    from twilio.rest import Client
-
     description = ("This script monitors available campsites based on the provided URL \n"
                    "For full README, check https://github.com/Mukrosz/parks \n"
                    " ---< Examples >--- \n"
@@ -183,11 +258,34 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     if args.sms:
-        # Initialize Twilio client
-        client = Client(args.twilio_sid, args.twilio_auth_token)
+        # Twilio API, only needed for SMS notifications
+        try:
+            from twilio.rest import Client
+            client = Client(args.twilio_sid, args.twilio_auth_token)
+        except ImportError:
+            sys.exit('Error: Twilio module not found. Install with `pip install twilio`')
+
+        # PyShorter - TinyURL
+        try:
+            import pyshorteners
+        except ImportError:
+            sys.exit('Error: pyshorteners module not found. Please install it using `pip install pyshorteners`')
+
+        # URL is constant for the session, shorten it once rather than per SMS
+        try:
+            short_url = shorten_url(args.url)
+        except Exception as e:
+            print('⚠️  Could not shorten URL, sending it in full: {}'.format(e))
+            short_url = args.url
+
+        # Twilio latency must not delay the next check
+        sms_pool = concurrent.futures.ThreadPoolExecutor(max_workers = 2)
 
-    site_name_params = parse_url(args.url, ["resourceLocationId", "mapId"])
-    site_status_params = parse_url(args.url, ["mapId", "startDate", "endDate"])
+    try:
+        site_name_params = parse_url(args.url, ["resourceLocationId", "mapId"])
+        site_status_params = parse_url(args.url, ["mapId", "startDate", "endDate"])
+    except BcParksError as e:
+        sys.exit(e)
 
     url_base = 'https://camping.bcparks.ca/api/'
     site_names_url  = '{}resourcelocation/resources?{}'.format(url_base, urlencode(site_name_params))
@@ -195,32 +293,99 @@ if __name__ == '__main__':
 
     headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"}
 
-    try:
-        while True:
+    desired_sites = frozenset(args.filter) if args.filter else None
+
+    # Connections are reused across checks, TLS handshake happens once
+    session = make_session(headers)
+
+    # Park's site catalog rarely changes, only availability is polled. Loaded on the first check
+    names = None
 
-            site_names_dict = make_request(site_names_url, headers)
-            site_status_dict = make_request(site_status_url, headers)
+    # Ids still missing from the catalog after reloading it, they don't trigger another reload
+    missing_ids = set()
 
-            sites = normalize_sites(site_names_dict, site_status_dict)
+    # Fetches the catalog alongside availability when a poll needs both
+    fetch_pool = concurrent.futures.ThreadPoolExecutor(max_workers = 1)
 
-            available_sites = get_available_sites(sites, args.filter if args.filter else list(sites.keys()))
+    # Wait after a failed check, doubles on each consecutive failure
+    backoff = max(args.interval, 1)
+
+    # First Ctrl+C wakes the loop up instead of raising mid-request, a second one aborts right away
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        stop.set()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    signal.signal(signal.SIGINT, request_stop)
+
+    # Sites included in the last SMS, only a different set triggers a new one.
+    # A failed send sets sms_failed, which forgets that set so the next poll retries
+    last_reported = frozenset()
+    sms_failed = threading.Event()
+
+    try:
+        while not stop.is_set():
+            # Fixed cadence regardless of how long the requests take, jittered by ±5%
+            # so several monitors started together don't hit the API in lockstep
+            deadline = time.monotonic() + args.interval * random.uniform(0.95, 1.05)
+
+            try:
+                if names is None:
+                    # Both endpoints are independent, fetch them side by side
+                    site_names_future = fetch_pool.submit(make_request, session, site_names_url)
+                    site_status_dict = make_request(session, site_status_url)
+                    names = site_names(site_names_future.result())
+                    missing_ids |= unknown_site_ids(names, site_status_dict)
+                else:
+                    site_status_dict = make_request(session, site_status_url)
+
+                    # Reload the catalog only when availability mentions a site it doesn't have yet
+                    if unknown_site_ids(names, site_status_dict) - missing_ids:
+                        names = site_names(make_request(session, site_names_url))
+                        missing_ids |= unknown_site_ids(names, site_status_dict)
+
+                available_sites = get_available_sites(names, site_status_dict, desired_sites)
+            except BcParksError as e:
+                print('{} - {}, retrying in {}s'.format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), e, backoff))
+                stop.wait(backoff)
+                backoff = min(backoff * 2, max(MAX_BACKOFF, args.interval))
+                continue
+
+            backoff = max(args.interval, 1)
 
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             if available_sites:
-                print('{} - Available sites: {}'.format(timestamp, ','.join(available_sites)))
+                message = f"{timestamp} - Available sites: {','.join(available_sites)}"
+                print(message)
                 if args.sms:
-                    send_sms('{} - Available sites: {}\n{}'.format(timestamp, ','.join(available_sites), shorten_url(args.url)),
-                             client,
-                             args.my_phone_number,
-                             args.twilio_number
-                    )
+                    if sms_failed.is_set():
+                        sms_failed.clear()
+                        last_reported = frozenset()
+
+                    if frozenset(available_sites) != last_reported:
+                        sms_pool.submit(send_sms,
+                                        f"{message}\n{short_url}",
+                                        client,
+                                        args.my_phone_number,
+                                        args.twilio_number
+                        ).add_done_callback(functools.partial(log_sms_result, failed = sms_failed))
+                        last_reported = frozenset(available_sites)
             else:
-                print('{} - No Availability'.format(timestamp))
+                print(f"{timestamp} - No Availability")
+                last_reported = frozenset()
 
-            time.sleep(args.interval)
+            stop.wait(max(0, deadline - time.monotonic()))
 
-    except KeyboardInterrupt:
         print("Stopping the script.")
 
+    except KeyboardInterrupt:
+        print("Script aborted.")
+
     except Exception as e:
         print('❌ Unexpected error: {}'.format(e))
+
+    finally:
+        fetch_pool.shutdown(wait = False)
+        if args.sms:
+            sms_pool.shutdown(wait = True)